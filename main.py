@@ -1,11 +1,19 @@
-from flask import Flask, render_template, request, redirect, url_for, flash , session
+from flask import Flask, render_template, request, redirect, url_for, flash , session, make_response, g
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from flask_compress import Compress
 from dotenv import load_dotenv
-from werkzeug.security import check_password_hash
-import json
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.security import check_password_hash, generate_password_hash
+import atexit
+import hashlib
+import hmac
+import orjson
 import os
+import secrets
+import threading
+import time
 
 load_dotenv()
 
@@ -15,36 +23,177 @@ app.secret_key = os.environ.get("FLASK_SECRET_KEY")
 
 if not app.secret_key:
     raise RuntimeError("FLASK_SECRET_KEY not found in environment or .env file.")
+
+# Persist compiled templates across restarts and workers, and skip the
+# per-render mtime check outside debug mode.
+if not app.debug:
+    os.makedirs(".jinja_cache", exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory=".jinja_cache")
+    app.jinja_env.auto_reload = False
+    app.config["TEMPLATES_AUTO_RELOAD"] = False
 # Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
 
-# Rate limiter for login
-limiter = Limiter(key_func=get_remote_address, app=app)
+# Rate limiter for login. The default memory:// storage is per-process;
+# set LIMITER_STORAGE_URI (e.g. redis://localhost:6379) in production so
+# limits are shared across workers.
+limiter = Limiter(
+    key_func=get_remote_address,
+    app=app,
+    storage_uri=os.environ.get("LIMITER_STORAGE_URI", "memory://"),
+)
+
+# Compress HTML/CSS/JS responses; the customer tables grow with view size.
+app.config["COMPRESS_MIMETYPES"] = ["text/html", "text/css", "application/javascript"]
+app.config["COMPRESS_LEVEL"] = 5
+app.config["COMPRESS_MIN_SIZE"] = 500
+Compress(app)
 
 DATA_FILE = "data.json"
 USERS_FILE = "users.json"
 DEFAULT_VIEW = "default"
 
+# Per-view people caps, parsed once at startup from e.g.
+# VIEW_CAPS="main:80,overflow:20". Views not listed use DEFAULT_CAP.
+DEFAULT_CAP = 50
+_view_caps = {}
+for _entry in os.environ.get("VIEW_CAPS", "").split(","):
+    if ":" in _entry:
+        _view, _, _cap = _entry.partition(":")
+        _view_caps[_view.strip()] = int(_cap)
+
+
+def view_cap(view_name):
+    """Returns the people capacity for a view."""
+    return _view_caps.get(view_name, DEFAULT_CAP)
+
+# Each view is stored as parallel per-field lists (structure-of-arrays)
+# so bulk scans like total_people touch one flat list instead of n dicts.
+_VIEW_FIELDS = ("names", "phones", "rooms", "amounts", "arrived", "second_phones")
+
+
+def _new_view():
+    return {field: [] for field in _VIEW_FIELDS}
+
+
+def _migrate_view(custs):
+    """Converts the old list-of-dicts view layout to parallel lists."""
+    view = _new_view()
+    for cust in custs:
+        view["names"].append(cust["name"])
+        view["phones"].append(cust["phone"])
+        view["rooms"].append(cust["room"])
+        view["amounts"].append(cust["amount"])
+        view["arrived"].append(cust.get("arrived", False))
+        view["second_phones"].append(cust.get("second_phone", ""))
+    return view
+
+
+def view_rows(view):
+    """Zips the per-field lists back into per-customer dicts for templates."""
+    return [
+        {"name": n, "phone": p, "room": r, "amount": a, "arrived": ar,
+         "second_phone": sp}
+        for n, p, r, a, ar, sp in zip(
+            view["names"], view["phones"], view["rooms"], view["amounts"],
+            view["arrived"], view["second_phones"])
+    ]
+
 # ------------------- User Handling -------------------
 class User(UserMixin):
     def __init__(self, username):
         self.id = username
 
 
+# Parsed-file caches, keyed by (st_mtime_ns, st_size) so an on-disk change
+# invalidates them. The lock matters because the dev server is threaded.
+_cache_lock = threading.Lock()
+_users_cache = {"key": None, "value": None, "by_name": None}
+_all_data_cache = {"key": None, "value": None}
+
+# This process is the only writer of DATA_FILE, so once loaded the cache
+# is authoritative and reads skip the change-detection stat entirely.
+# Set DATA_CACHE_AUTHORITATIVE=0 if something else edits the file while
+# the app runs; /admin/reload forces a re-read either way.
+_CACHE_AUTHORITATIVE = os.environ.get("DATA_CACHE_AUTHORITATIVE", "1") == "1"
+
+# Write coalescing: save_all_data marks the cache dirty and a daemon
+# thread flushes to disk once writes have settled for the debounce window.
+_FLUSH_INTERVAL = 0.1
+_FLUSH_DEBOUNCE = 0.2
+_dirty = False
+_dirty_since = 0.0
+# Bumped on every save so the flusher can tell whether a new save landed
+# while it was writing, instead of blindly marking the cache clean.
+_save_gen = 0
+
+# Per-view people totals, rebuilt whenever the data file is (re)parsed
+# and maintained incrementally by the mutating routes.
+_totals = {}
+
+
+def _rebuild_totals(all_data):
+    _totals.clear()
+    for view_name, view in all_data.items():
+        _totals[view_name] = sum(view["amounts"])
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
 def load_users():
-    if not os.path.exists(USERS_FILE):
-        return []
-    with open(USERS_FILE, "r") as f:
-        return json.load(f)
+    with _cache_lock:
+        try:
+            key = _file_key(USERS_FILE)
+        except FileNotFoundError:
+            return []
+        if key != _users_cache["key"]:
+            with open(USERS_FILE, "rb") as f:
+                users = orjson.loads(f.read())
+            _users_cache["value"] = users
+            # Index by username so find_user is a dict lookup instead of
+            # a linear scan on every authenticated request.
+            _users_cache["by_name"] = {u.get("username"): u for u in users}
+            _users_cache["key"] = key
+        return _users_cache["value"]
 
 
 def find_user(username):
-    for u in load_users():
-        if u.get("username") == username:
-            return u
-    return None
+    if not load_users():
+        return None
+    return _users_cache["by_name"].get(username)
+
+
+# Successful password verifications, keyed by (stored hash, HMAC of the
+# submitted password under a per-process salt). Repeat correct logins
+# skip the deliberately slow KDF; failures are never cached, so
+# brute-force attempts still pay the full cost, and the salt makes the
+# cached digests useless outside this process.
+_VERIFY_SALT = secrets.token_bytes(32)
+
+# Verified against when the username doesn't exist, so failed logins
+# cost the same KDF work either way and response timing doesn't leak
+# which usernames are real.
+_DUMMY_HASH = generate_password_hash(secrets.token_hex(16))
+_VERIFY_CACHE_MAX = 256
+_verify_cache = set()
+
+
+def verify_password(password_hash, password):
+    digest = hmac.new(_VERIFY_SALT, password.encode(), hashlib.sha256).digest()
+    key = (password_hash, digest)
+    if key in _verify_cache:
+        return True
+    if check_password_hash(password_hash, password):
+        if len(_verify_cache) >= _VERIFY_CACHE_MAX:
+            _verify_cache.clear()
+        _verify_cache.add(key)
+        return True
+    return False
 
 
 @login_manager.user_loader
@@ -60,47 +209,168 @@ def load_user(user_id):
 
 def load_all_data():
     """Loads the entire data dictionary: {view_name: [customers], ...}"""
-    if not os.path.exists(DATA_FILE):
-        # Initialize with a default view if the file doesn't exist
-        return {DEFAULT_VIEW: []} 
-    with open(DATA_FILE, "r") as f:
+    with _cache_lock:
+        # While a write is pending the cache is newer than the file, so
+        # skip the mtime check and serve the in-memory dict directly.
+        # As the single writer the cache is authoritative after the
+        # initial load and reads need no stat at all.
+        if _dirty or (_CACHE_AUTHORITATIVE and _all_data_cache["value"] is not None):
+            return _all_data_cache["value"]
         try:
-            data = json.load(f)
-            # Ensure the data structure is a dictionary
-            return data if isinstance(data, dict) else {DEFAULT_VIEW: []}
-        except json.JSONDecodeError:
-            return {DEFAULT_VIEW: []}
+            key = _file_key(DATA_FILE)
+        except FileNotFoundError:
+            # Initialize with a default view if the file doesn't exist
+            data = {DEFAULT_VIEW: _new_view()}
+            if _CACHE_AUTHORITATIVE:
+                _all_data_cache["value"] = data
+                _rebuild_totals(data)
+            return data
+        if key != _all_data_cache["key"]:
+            with open(DATA_FILE, "rb") as f:
+                try:
+                    data = orjson.loads(f.read())
+                    # Ensure the data structure is a dictionary
+                    if not isinstance(data, dict):
+                        data = {DEFAULT_VIEW: _new_view()}
+                except orjson.JSONDecodeError:
+                    data = {DEFAULT_VIEW: _new_view()}
+            # One-shot migration of views still in the old list-of-dicts
+            # layout; persisted on the next save.
+            for view_name, view in data.items():
+                if isinstance(view, list):
+                    data[view_name] = _migrate_view(view)
+            _all_data_cache["value"] = data
+            _all_data_cache["key"] = key
+            _rebuild_totals(data)
+        return _all_data_cache["value"]
 
 
 def save_all_data(data):
-    """Saves the entire data dictionary to the file."""
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    """Saves the entire data dictionary.
+
+    The in-memory cache becomes authoritative immediately; the actual
+    disk write is coalesced by the background flusher so a burst of
+    POSTs costs one file rewrite instead of one per request.
+    """
+    global _dirty, _dirty_since, _save_gen
+    with _cache_lock:
+        _all_data_cache["value"] = data
+        _save_gen += 1
+        if not _dirty:
+            _dirty = True
+            _dirty_since = time.monotonic()
+
+
+def flush_data():
+    """Writes the cached dict to disk if there are pending changes."""
+    global _dirty
+    with _cache_lock:
+        if not _dirty:
+            return
+        # Serialize while holding the lock so request threads mutating
+        # the cached dict in place can't be captured mid-update as a
+        # torn snapshot; the payload is small, so this is cheap.
+        # Compact output in production — the file is machine-read; the
+        # indented form is only worth the extra bytes when debugging.
+        dump_opts = orjson.OPT_INDENT_2 if app.debug else 0
+        payload = orjson.dumps(_all_data_cache["value"], option=dump_opts)
+        gen = _save_gen
+    # Write to a temp file in the same directory and rename over the
+    # original so readers never see a truncated or half-written file.
+    tmp = DATA_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, DATA_FILE)
+    with _cache_lock:
+        _all_data_cache["key"] = _file_key(DATA_FILE)
+        # A save that landed while we were writing isn't in this payload;
+        # leave the cache dirty so the flusher picks it up next wake-up.
+        if _save_gen == gen:
+            _dirty = False
+
+
+def _flush_loop():
+    while True:
+        time.sleep(_FLUSH_INTERVAL)
+        with _cache_lock:
+            due = _dirty and time.monotonic() - _dirty_since >= _FLUSH_DEBOUNCE
+        if due:
+            try:
+                flush_data()
+            except Exception:
+                # A transient write failure (disk full, permissions) must
+                # not kill the flusher thread — the cache stays dirty and
+                # the write is retried on the next wake-up.
+                app.logger.exception("Failed to flush %s; will retry", DATA_FILE)
+
+
+_flusher = threading.Thread(target=_flush_loop, daemon=True)
+_flusher.start()
+# The flusher is a daemon thread, so persist any last pending write on
+# interpreter shutdown.
+atexit.register(flush_data)
 
 
 def load_view_data(view_name):
     """Loads customer data for a specific view."""
     all_data = load_all_data()
-    return all_data.get(view_name, [])
+    return all_data.get(view_name) or _new_view()
 
 
-def save_view_data(view_name, view_data):
-    """Saves customer data back to a specific view."""
-    all_data = load_all_data()
+def save_view_data(view_name, view_data, all_data=None):
+    """Saves customer data back to a specific view.
+
+    Callers that already hold the full dict can pass it as all_data to
+    avoid a redundant load_all_data() round-trip.
+    """
+    if all_data is None:
+        all_data = load_all_data()
     all_data[view_name] = view_data
     save_all_data(all_data)
     
 
-def get_all_views():
-    """Returns a list of all current view names."""
-    return list(load_all_data().keys())
+def total_people(view_name):
+    """Returns the cached total number of people for a view."""
+    return _totals.get(view_name, 0)
+
+
+def _render_cached(template, etag_suffix, **context):
+    """render_template with a weak ETag derived from the data-file state.
+
+    Browsers revalidate on every request (no-cache) but get a 304 when
+    nothing changed, skipping the render entirely. Responses carrying
+    flashed messages are never shortcut.
+    """
+    with _cache_lock:
+        key = None if _dirty else _all_data_cache["key"]
+    if key is None:
+        return render_template(template, **context)
+    if "_flashes" in session:
+        # The render below consumes the flashed messages, so this body
+        # differs from the clean page. Never tag it — a cached copy
+        # revalidating as 304 would re-show the stale flash — and mark
+        # it no-store so it isn't kept at all.
+        resp = make_response(render_template(template, **context))
+        resp.cache_control.no_store = True
+        return resp
+    etag = f"{key[0]:x}-{key[1]:x}-{etag_suffix}"
+    if request.if_none_match.contains_weak(etag):
+        return app.response_class(status=304)
+    resp = make_response(render_template(template, **context))
+    resp.set_etag(etag, weak=True)
+    resp.cache_control.no_cache = True
+    return resp
 
+# ------------------- Routes -------------------
+@app.before_request
+def _resolve_view():
+    # Resolve the session's current view once so handlers read g.view_name
+    # instead of repeating the session lookup and fallback.
+    g.view_name = session.get('current_view', DEFAULT_VIEW)
 
-def total_people(data):
-    """Calculates total people for a given list of customers."""
-    return sum(cust["amount"] for cust in data)
 
-# ------------------- Routes -------------------
 @app.route("/")
 def index():
     # Initialize the session view if it's not set
@@ -117,8 +387,9 @@ def login():
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "")
         user = find_user(username)
+        pwhash = user["password_hash"] if user else _DUMMY_HASH
 
-        if user and check_password_hash(user["password_hash"], password):
+        if verify_password(pwhash, password) and user:
             login_user(User(username))
             flash("Logged in successfully!", "success")
             return redirect(url_for("register"))
@@ -142,9 +413,11 @@ def logout():
 @app.route("/register", methods=["GET", "POST"])
 @login_required
 def register():
-    view_name = session.get('current_view', DEFAULT_VIEW)
-    data = load_view_data(view_name) # Load data for the current view
-    current_total = total_people(data)
+    view_name = g.view_name
+    all_data = load_all_data()
+    data = all_data.setdefault(view_name, _new_view())  # Data for the current view
+    current_total = total_people(view_name)
+    cap = view_cap(view_name)
 
     if request.method == "POST":
         name = request.form.get("name", "").strip()
@@ -168,48 +441,56 @@ def register():
             flash("Second phone required for groups larger than 6!", "error")
             return redirect(url_for("register"))
 
-        if total_people(data) + amount > 50:
-            flash(f"Cannot register: total for '{view_name}' would exceed 50 (current {total_people(data)})", "error")
+        if current_total + amount > cap:
+            flash(f"Cannot register: total for '{view_name}' would exceed {cap} (current {current_total})", "error")
             return redirect(url_for("register"))
 
-        data.append({
-            "name": name,
-            "phone": phone,
-            "room": room,
-            "amount": amount,
-            "arrived": False,
-            "second_phone": second_phone or ""
-        })
-        save_view_data(view_name, data)
+        # Append and bump the total under the cache lock: the increment
+        # must read the live total (current_total is a stale pre-check
+        # snapshot under concurrent POSTs), and the flusher serializes
+        # the dict under this lock, so the six lists stay aligned.
+        with _cache_lock:
+            data["names"].append(name)
+            data["phones"].append(phone)
+            data["rooms"].append(room)
+            data["amounts"].append(amount)
+            data["arrived"].append(False)
+            data["second_phones"].append(second_phone or "")
+            _totals[view_name] = _totals.get(view_name, 0) + amount
+        save_all_data(all_data)
         flash("Customer registered successfully!", "success")
         return redirect(url_for("register"))
 
-    return render_template("register.html", total=current_total, current_view=view_name, all_views=get_all_views())
+    return _render_cached("register.html", view_name, total=current_total, cap=cap, current_view=view_name, all_views=list(all_data.keys()))
 
 # ---- Arrived ----
 @app.route("/arrived", methods=["GET", "POST"])
 @login_required
 def arrived():
-    view_name = session.get('current_view', DEFAULT_VIEW)
-    data = load_view_data(view_name)
+    view_name = g.view_name
+    all_data = load_all_data()
+    data = all_data.setdefault(view_name, _new_view())
     if request.method == "POST":
-        selected = request.form.getlist("arrived") or []
+        selected = set(request.form.getlist("arrived"))
 
-        for cust in data:
-            cust["arrived"] = cust.get("name") in selected
+        data["arrived"] = [name in selected for name in data["names"]]
 
-        save_view_data(view_name, data)
+        save_all_data(all_data)
         flash(f"Arrived status updated for view: {view_name}!", "success")
         return redirect(url_for("arrived"))
 
-    return render_template("arrived.html", customers=data, current_view=view_name, all_views=get_all_views())
+    return _render_cached("arrived.html", view_name, customers=view_rows(data), current_view=view_name, all_views=list(all_data.keys()))
 
 # ---- Delete All ----
 @app.route("/delete_all", methods=["POST"])
 @login_required
 def delete_all():
-    view_name = session.get('current_view', DEFAULT_VIEW)
-    save_view_data(view_name, [])
+    view_name = g.view_name
+    all_data = load_all_data()
+    with _cache_lock:
+        all_data[view_name] = _new_view()
+        _totals[view_name] = 0
+    save_all_data(all_data)
     flash(f"All customer data for view '{view_name}' deleted!", "success")
     return redirect(url_for("register"))
 
@@ -232,13 +513,17 @@ def manage_views():
             if view_name in all_views:
                 flash(f"View '{view_name}' already exists.", "error")
             else:
-                all_data[view_name] = []
+                with _cache_lock:
+                    all_data[view_name] = _new_view()
+                    _totals[view_name] = 0
                 save_all_data(all_data)
                 flash(f"View '{view_name}' created successfully.", "success")
         
         elif action == "delete":
             if view_name in all_data and view_name != DEFAULT_VIEW:
-                del all_data[view_name]
+                with _cache_lock:
+                    del all_data[view_name]
+                    _totals.pop(view_name, None)
                 save_all_data(all_data)
                 # If the deleted view was active, switch to default
                 if session.get('current_view') == view_name:
@@ -251,15 +536,14 @@ def manage_views():
 
         return redirect(url_for("manage_views"))
 
-    return render_template("manage_views.html", views=all_views, default_view=DEFAULT_VIEW)
+    return _render_cached("manage_views.html", "views", views=all_views, default_view=DEFAULT_VIEW)
 
 
 # New Route: `/views/select` (To Switch Views)
 @app.route("/views/select/<view_name>")
 @login_required
 def select_view(view_name):
-    all_views = get_all_views()
-    if view_name in all_views:
+    if view_name in load_all_data():
         session['current_view'] = view_name
         flash(f"Switched to view: {view_name}", "success")
     else:
@@ -267,6 +551,27 @@ def select_view(view_name):
     
     return redirect(url_for("register"))
 
+# ---- Reload ----
+@app.route("/admin/reload")
+@login_required
+def reload_data():
+    # Persist anything pending first so our own writes aren't lost, then
+    # drop the cache and re-read the file picking up out-of-band edits.
+    flush_data()
+    with _cache_lock:
+        # Re-check under the lock: a save racing the flush above leaves
+        # the cache dirty, and dropping it here would discard that save
+        # and hand out a None cache. Keep the dirty dict instead — the
+        # flusher persists it and the reload can be retried.
+        if _dirty:
+            flash("Reload skipped: a write was in flight; try again.", "error")
+            return redirect(url_for("register"))
+        _all_data_cache["key"] = None
+        _all_data_cache["value"] = None
+    load_all_data()
+    flash("Data reloaded from disk.", "success")
+    return redirect(url_for("register"))
+
 # ------------------- Run -------------------
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)